@@ -1,24 +1,52 @@
-import requests
 import asyncio
-import json
+import orjson
 import os
-import sys
+import random
+import re
+import shlex
 import logging
-from fastapi import FastAPI, HTTPException, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import NotModifiedResponse
+from pydantic import AliasChoices, AliasPath, BaseModel, ConfigDict, Field, TypeAdapter, ValidationError
+from typing import AsyncIterator, List, Optional, Dict, Any, Tuple, Union
+from collections import deque
+import httpx
 import uvicorn
-import uuid # Import uuid for request ID generation
+import functools
+import hashlib
+import mimetypes
+from cachetools import LRUCache, TTLCache
 
 class ChatMessage(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     role: str
-    content: Any # Use Any to allow for both string and list content
+    # Plain text, or OpenAI-style content parts ({"type": "text", ...}, {"type": "image_url", ...}).
+    # A concrete union validates on pydantic's typed path instead of the Any fallback.
+    content: Union[str, List[Dict[str, Any]]]
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
+logger = logging.getLogger(__name__)
 
-logging.basicConfig(level=logging.INFO)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Per-worker resources live on app.state for the life of the process
+    app.state.http_client = create_openrouter_client()
+    app.state.mcp_client = SequentialThinkingMCPClient(MCP_SEQUENTIAL_THINKING_COMMAND)
+    await app.state.mcp_client.start()
+    try:
+        yield
+    finally:
+        await app.state.mcp_client.stop()
+        await app.state.http_client.aclose()
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
 
 origins = [
     "http://localhost:4200",
@@ -32,67 +60,351 @@ app.add_middleware(
     allow_headers=["*"], # Allow all headers
 )
 
-# --- MCP Sequential Thinking Integration ---
-async def invoke_sequential_thinking(params: Dict[str, Any]) -> Dict[str, Any]:
-    """Invokes the sequential_thinking tool on the MCP server."""
-    # This function assumes the MCP server is already running and communicating via stdin/stdout.
-    # It sends a JSON-RPC request and waits for a response.
-    # As per task instructions, there is no automatic rpc.discover call here.
-    # Note: This implementation is simplified and lacks robust error handling
-    # for a disconnected or unresponsive external process, and the response reading is a placeholder.
-
-    request_id = f"req-{uuid.uuid4()}" # Use UUID for request ID
-
-    jsonrpc_request = {
-        "jsonrpc": "2.0",
-        "method": "sequentialthinking",
-        "params": params,
-        "id": request_id
-    }
+# --- Shared OpenRouter HTTP client ---
+# A single pooled client, created in lifespan and kept on app.state.http_client, is reused
+# by every handler so concurrent requests share keep-alive HTTP/2 connections instead of
+# paying a TCP/TLS handshake per call.
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1"
+
+def create_openrouter_client() -> httpx.AsyncClient:
+    # The transport owns the HTTP/2 pool; its retries only re-attempt failed connects,
+    # never a request that reached OpenRouter. The large /models catalog compresses well,
+    # so Brotli is advertised ahead of gzip.
+    return httpx.AsyncClient(
+        base_url=OPENROUTER_API_URL,
+        headers={"Accept-Encoding": "br, gzip"},
+        # Fail fast on an unreachable host, but give slow generations a full minute.
+        timeout=httpx.Timeout(60.0, connect=5.0),
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        ),
+    )
+
+# Chat payloads are sent as orjson-encoded bytes rather than through httpx's stdlib json=,
+# so the content type comes from these headers.
+_CONTENT_TYPE_JSON = "application/json"
+
+# Caps concurrent OpenRouter calls per worker, below the pool's max_connections, so a burst
+# of chats queues here instead of fanning out into provider 429s. Tune to your OpenRouter tier.
+OPENROUTER_MAX_CONCURRENCY = int(os.getenv("OPENROUTER_MAX_CONCURRENCY", "50"))
+OPENROUTER_SEM = asyncio.Semaphore(OPENROUTER_MAX_CONCURRENCY)
+
+@functools.lru_cache(maxsize=1024)
+def _openrouter_headers(api_key: str) -> Tuple[Tuple[str, str], ...]:
+    """Returns the OpenRouter request headers for an API key as an immutable, shareable tuple."""
+    return (("authorization", f"Bearer {api_key}"), ("content-type", _CONTENT_TYPE_JSON))
+
+def _upstream_error(response: httpx.Response) -> HTTPException:
+    """Maps a failed OpenRouter response to an HTTPException with the same status code.
 
+    Forwarding 429 (with Retry-After) and 4xx as-is lets the frontend tell a retryable
+    rate limit from a bad key instead of seeing every failure as a 500.
+    """
     try:
-        # Send request to the external MCP server via stdout (assuming it's listening on stdin)
-        request_str = json.dumps(jsonrpc_request) + "\n"
-        sys.stdout.write(request_str)
-        sys.stdout.flush()
-        print(f"Sent to MCP: {request_str.strip()}")
-
-        # In a real-world scenario with an external process, you would need a mechanism
-        # to read responses from its stdout/stderr asynchronously and match them by ID.
-        # For this refactoring, we'll simulate a response mechanism or assume
-        # the external process handles the response flow.
-        # A simple approach for demonstration might involve reading a single line,
-        # but a robust solution requires a dedicated background reader.
-
-        # Placeholder for reading response - this needs a proper async implementation
-        # that reads from the external process's stdout/stderr.
-        # For now, we'll just return a placeholder success response.
-        # TODO: Implement robust asynchronous reading of responses from the external MCP process.
-        # This part is intentionally left basic as the focus of this task is removing subprocess management
-        # and the rpc.discover call, not implementing a full async stdio reader.
-        # A full implementation would involve reading from sys.stdin (if the external process
-        # writes responses to its stdout, which becomes this process's stdin) or
-        # setting up a separate communication channel.
-        print("Waiting for response from external MCP process (placeholder)...")
-
-        # Simulate a successful response structure for now
-        simulated_response = {
-            "jsonrpc": "2.0",
-            "result": {"thought": "Placeholder thought from external MCP"},
-            "id": request_id
-        }
-        return simulated_response["result"]
-
-
-    except Exception as e:
-        print(f"Error invoking Sequential Thinking MCP (assuming external process): {e}", file=sys.stderr)
-        raise HTTPException(status_code=500, detail=f"Error communicating with external MCP server: {e}")
+        detail = orjson.loads(response.content)["error"]["message"]
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        detail = response.text
+    retry_after = response.headers.get("retry-after")
+    return HTTPException(
+        status_code=response.status_code,
+        detail=f"OpenRouter API error: {detail}",
+        headers={"Retry-After": retry_after} if retry_after else None,
+    )
+
+# 429s and gateway errors are usually gone a moment later, so they are retried with capped
+# exponential backoff and full jitter (concurrent retries spread out instead of arriving in
+# lockstep). A Retry-After longer than the cap is passed to the caller instead of waited out.
+OPENROUTER_MAX_RETRIES = int(os.getenv("OPENROUTER_MAX_RETRIES", "2"))
+OPENROUTER_RETRY_BASE_SECONDS = 0.5
+OPENROUTER_RETRY_MAX_SECONDS = 8.0
+_RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+def _retry_delay(attempt: int, response: httpx.Response) -> Optional[float]:
+    """Returns how long to wait before retrying a failed response, or None to give up."""
+    if response.status_code not in _RETRYABLE_STATUS_CODES or attempt >= OPENROUTER_MAX_RETRIES:
+        return None
+    retry_after = response.headers.get("retry-after", "")
+    if retry_after.isdigit():
+        delay = float(retry_after)
+        return delay if delay <= OPENROUTER_RETRY_MAX_SECONDS else None
+    return random.uniform(0, min(OPENROUTER_RETRY_MAX_SECONDS, OPENROUTER_RETRY_BASE_SECONDS * 2 ** attempt))
+
+async def _send_openrouter(client: httpx.AsyncClient, upstream_request: httpx.Request, stream: bool = False) -> httpx.Response:
+    """Sends a request under OPENROUTER_SEM, retrying transient failures.
+
+    Each attempt holds its own slot and backoff sleeps hold none. A final failure raises
+    _upstream_error. With stream=True the returned response keeps its slot, and the caller
+    releases OPENROUTER_SEM once it has closed the response.
+    """
+    attempt = 0
+    while True:
+        await OPENROUTER_SEM.acquire()
+        try:
+            response = await client.send(upstream_request, stream=stream)
+        except BaseException:
+            OPENROUTER_SEM.release()
+            raise
+        if response.status_code < 400:
+            if not stream:
+                OPENROUTER_SEM.release()
+            return response
+
+        # The slot is given back even if reading the error body fails or the caller is cancelled
+        try:
+            await response.aread()
+        finally:
+            try:
+                await response.aclose()
+            finally:
+                OPENROUTER_SEM.release()
+        delay = _retry_delay(attempt, response)
+        if delay is None:
+            raise _upstream_error(response)
+        logger.warning("OpenRouter returned %d, retrying in %.2fs", response.status_code, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+# --- End Shared OpenRouter HTTP client ---
+
+# --- MCP Sequential Thinking Integration ---
+# The MCP server runs as a child process owned by SequentialThinkingMCPClient. Requests are
+# written to its stdin and a single reader task parses each stdout line and resolves the
+# waiting future directly, so a response costs one await, not a queue hop. Its stderr is
+# human-readable logging only.
+# Off by default: every worker would otherwise start its own node process (and possibly an
+# npx download). Set it to e.g. "npx -y @modelcontextprotocol/server-sequential-thinking".
+MCP_SEQUENTIAL_THINKING_COMMAND = os.getenv("MCP_SEQUENTIAL_THINKING_COMMAND", "")
+MCP_PROTOCOL_VERSION = "2024-11-05"
+MCP_TOOL_NAME = "sequentialthinking"
+MCP_RESPONSE_TIMEOUT_SECONDS = 30
+MCP_INITIALIZE_TIMEOUT_SECONDS = 120 # Covers npx fetching the package on a cold start
+MCP_SHUTDOWN_TIMEOUT_SECONDS = 5
+MCP_STREAM_LIMIT = 1 << 20 # Thinking payloads can exceed the default 64 KiB line buffer
+
+# In-flight requests live in a fixed slot table instead of a dict keyed by string ids.
+# A JSON-RPC id encodes its slot as id % MCP_MAX_IN_FLIGHT; the rest is a per-slot
+# generation, so a late response for a timed-out request never resolves the slot's next user.
+MCP_MAX_IN_FLIGHT = 4096
+# Clamped so semaphore holders can never outnumber the slots in the table
+MCP_MAX_CONCURRENCY = min(int(os.getenv("MCP_MAX_CONCURRENCY", "4")), MCP_MAX_IN_FLIGHT)
+MCP_QUEUE_TIMEOUT_SECONDS = 10
+
+# The sequentialthinking tool's input schema, checked locally by pydantic's compiled
+# validator so a malformed thought is dropped without a round-trip to the MCP server.
+# Unknown fields are passed through for the server to judge.
+class SequentialThinkingParams(BaseModel):
+    model_config = ConfigDict(extra='allow')
+
+    thought: str
+    nextThoughtNeeded: bool
+    thoughtNumber: int = Field(ge=1)
+    totalThoughts: int = Field(ge=1)
+    isRevision: Optional[bool] = None
+    revisesThought: Optional[int] = Field(default=None, ge=1)
+    branchFromThought: Optional[int] = Field(default=None, ge=1)
+    branchId: Optional[str] = None
+    needsMoreThoughts: Optional[bool] = None
+
+class SequentialThinkingMCPClient:
+    """One Sequential Thinking MCP server process and the requests in flight to it.
+
+    lifespan creates a single instance per worker on app.state.mcp_client; handlers reach
+    it through request.app.state, so every request shares the one stdio pipe.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._futures: List[Optional[Tuple[int, asyncio.Future]]] = [None] * MCP_MAX_IN_FLIGHT
+        self._free_slots: deque = deque(range(MCP_MAX_IN_FLIGHT))
+        self._slot_generations: List[int] = [0] * MCP_MAX_IN_FLIGHT
+        # The server works through requests one stdio line at a time; queue here rather than
+        # stacking a backlog in its pipe that would push every waiter towards the timeout.
+        # Holders never exceed MCP_MAX_CONCURRENCY <= MCP_MAX_IN_FLIGHT, so the slot table cannot run dry.
+        self._semaphore = asyncio.Semaphore(MCP_MAX_CONCURRENCY)
+        self._reader_task: Optional[asyncio.Task] = None
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._initialize_task: Optional[asyncio.Task] = None
+        self._initialized = False
+
+    @property
+    def running(self) -> bool:
+        return self.process is not None and self.process.returncode is None and not self._reader_task.done()
+
+    @property
+    def available(self) -> bool:
+        return self._initialized and self.running
+
+    async def start(self):
+        parts = shlex.split(self.command)
+        if not parts:
+            logger.info("MCP_SEQUENTIAL_THINKING_COMMAND is empty, sequential thinking is disabled")
+            return
+
+        # exec rather than a shell, so terminate() signals the server itself and not an intermediate sh
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *parts,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                limit=MCP_STREAM_LIMIT,
+            )
+        except FileNotFoundError:
+            logger.error("Command not found: %s", parts[0])
+            return
+        except OSError as e:
+            logger.error("Failed to start Sequential Thinking MCP server: %s", e)
+            return
+
+        logger.info("Started Sequential Thinking MCP server (pid %d)", self.process.pid)
+        self._reader_task = asyncio.create_task(self._read_responses(self.process.stdout))
+        self._stderr_task = asyncio.create_task(self._log_stderr(self.process.stderr))
+        # The handshake runs in the background so a slow first npx run does not hold up startup;
+        # calls made before it completes get a 503 and the chat continues without thinking.
+        self._initialize_task = asyncio.create_task(self._initialize())
+
+    async def _initialize(self):
+        """Performs the MCP initialize handshake, which the server requires before tools/call."""
+        try:
+            await self._request("initialize", {
+                "protocolVersion": MCP_PROTOCOL_VERSION,
+                "capabilities": {},
+                "clientInfo": {"name": "SimpleLLM", "version": "1.0"},
+            }, MCP_INITIALIZE_TIMEOUT_SECONDS)
+            self.process.stdin.write(orjson.dumps({"jsonrpc": "2.0", "method": "notifications/initialized"}) + b"\n")
+            await self.process.stdin.drain()
+        except (HTTPException, OSError) as e:
+            logger.error("Sequential Thinking MCP initialize failed, sequential thinking is disabled: %s", getattr(e, "detail", e))
+            return
+        self._initialized = True
+        logger.info("Sequential Thinking MCP server initialized")
+
+    async def stop(self):
+        process = self.process
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), MCP_SHUTDOWN_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+        for task in (self._initialize_task, self._reader_task, self._stderr_task):
+            if task is not None:
+                task.cancel()
+
+    async def _read_responses(self, stream: asyncio.StreamReader):
+        """Resolves pending MCP requests from JSON-RPC lines read off the stream."""
+        try:
+            async for raw in stream:
+                # JSON-RPC messages are objects; anything else is log chatter and is
+                # skipped on a one-byte check instead of a failed parse.
+                if raw[:1] != b"{":
+                    logger.debug("Ignoring non-JSON-RPC line from MCP server: %r", raw[:200])
+                    continue
+                try:
+                    message = orjson.loads(raw)
+                except orjson.JSONDecodeError:
+                    logger.warning("Ignoring malformed JSON line from MCP server: %r", raw[:200])
+                    continue
+                request_id = message.get("id")
+                if not isinstance(request_id, int):
+                    continue
+                pending = self._futures[request_id % MCP_MAX_IN_FLIGHT]
+                if pending is not None and pending[0] == request_id and not pending[1].done():
+                    pending[1].set_result(message)
+        finally:
+            # The server went away; fail anything still waiting instead of letting it time out.
+            # Slots are released by the waiting callers themselves.
+            for pending in self._futures:
+                if pending is not None and not pending[1].done():
+                    pending[1].set_exception(ConnectionError("MCP response stream closed"))
+
+    async def _log_stderr(self, stream: asyncio.StreamReader):
+        """Forwards the MCP server's stderr to the log without trying to parse it."""
+        async for raw in stream:
+            logger.info("MCP server: %s", raw.decode(errors='replace').rstrip())
+
+    async def invoke(self, params: Dict[str, Any]) -> Any:
+        """Calls the sequentialthinking tool and returns its decoded text result."""
+        if not self.available:
+            raise HTTPException(status_code=503, detail="MCP server connection is not available")
+
+        result = await self._request("tools/call", {"name": MCP_TOOL_NAME, "arguments": params})
+        content = result.get("content") if isinstance(result, dict) else None
+        text = content[0].get("text") if content and isinstance(content[0], dict) else None
+        if text is None or result.get("isError"):
+            raise HTTPException(status_code=502, detail=f"MCP tool error: {text or result}")
+        # The tool reports its state as a JSON document in the text part
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return text
+
+    async def _request(self, method: str, params: Dict[str, Any], timeout: float = MCP_RESPONSE_TIMEOUT_SECONDS) -> Any:
+        """Sends one JSON-RPC request and returns its result."""
+        if not self.running:
+            raise HTTPException(status_code=503, detail="MCP server connection is not available")
+
+        # MCP_MAX_CONCURRENCY is the one back-pressure point: waiters queue on the semaphore,
+        # but only for MCP_QUEUE_TIMEOUT_SECONDS, after which the call is shed with a 503.
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), MCP_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Too many concurrent MCP requests")
+        try:
+            slot = self._free_slots.popleft()
+            self._slot_generations[slot] += 1
+            request_id = self._slot_generations[slot] * MCP_MAX_IN_FLIGHT + slot
+
+            jsonrpc_request = {
+                "jsonrpc": "2.0",
+                "method": method,
+                "params": params,
+                "id": request_id
+            }
+
+            future = asyncio.get_running_loop().create_future()
+            self._futures[slot] = (request_id, future)
+
+            try:
+                # Send request to the MCP server over its stdin
+                self.process.stdin.write(orjson.dumps(jsonrpc_request) + b"\n")
+                await self.process.stdin.drain()
+
+                response = await asyncio.wait_for(future, timeout)
+
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=504, detail="Timed out waiting for MCP server response")
+            except ConnectionError:
+                raise HTTPException(status_code=503, detail="MCP server connection closed")
+            except Exception as e:
+                logger.exception("Error invoking Sequential Thinking MCP")
+                raise HTTPException(status_code=500, detail=f"Error communicating with external MCP server: {e}")
+            finally:
+                self._futures[slot] = None
+                self._free_slots.append(slot)
+        finally:
+            self._semaphore.release()
+
+        if "error" in response:
+            raise HTTPException(status_code=502, detail=f"MCP server error: {response['error']}")
+        return response.get("result")
 
 
 # --- End MCP Sequential Thinking Integration ---
 
 
+# Every decoded token is a full forward pass upstream, so a caller-supplied max_tokens is
+# clamped to this cap. Without one, no limit is sent: a silent default would cut replies
+# short (and cache them that way) with nothing telling the user the answer is incomplete.
+MAX_TOKENS_CAP = int(os.getenv("MAX_TOKENS_CAP", "4096"))
+
 class ChatRequest(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     # Keep existing fields like prompt, apiKey, modelId, etc.
     prompt: str # Keep prompt for potential use or ensure frontend sends last message here too
     apiKey: Optional[str] = None
@@ -102,166 +414,646 @@ class ChatRequest(BaseModel):
     sequential_thinking_params: Optional[Dict[str, Any]] = None
     # Add the history field:
     messages: List[ChatMessage] # Add this line
+    # Generation limits forwarded to OpenRouter; max_tokens is clamped to MAX_TOKENS_CAP
+    max_tokens: Optional[int] = Field(default=None, gt=0)
+    stop: Optional[List[str]] = None
+    temperature: Optional[float] = None
+    # Opt-in Server-Sent Events reply; the default stays a single JSON body
+    stream: Optional[bool] = False
 
+# PricingInfo/ModelInfo validate OpenRouter's raw /models entries directly: unknown
+# fields are ignored, price strings are coerced to floats, and missing prices default to 0.0.
 class PricingInfo(BaseModel):
-    prompt: Optional[float] = None
-    completion: Optional[float] = None
-    image: Optional[float] = None
-    request: Optional[float] = None
+    model_config = ConfigDict(extra='ignore')
+
+    prompt: Optional[float] = 0.0
+    completion: Optional[float] = 0.0
+    image: Optional[float] = 0.0
+    request: Optional[float] = 0.0
 
 class ModelInfo(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
     id: str
     name: str
-    pricing: PricingInfo
+    pricing: PricingInfo = Field(default_factory=PricingInfo)
     context_length: Optional[int] = None
-    input_modalities: List[str] = []
+    # Upstream nests this under "architecture"; the plain name is accepted too so
+    # already-processed entries validate unchanged.
+    input_modalities: List[str] = Field(
+        default=[],
+        validation_alias=AliasChoices("input_modalities", AliasPath("architecture", "input_modalities")),
+    )
+
+_MODELS_ADAPTER = TypeAdapter(List[ModelInfo])
+
+# --- Prompt prefix caching ---
+# Providers with prompt caching (Anthropic, Gemini via OpenRouter) only reuse work for a
+# byte-identical prefix. The optional system prompt is one constant message object sent
+# first in every request, marked as a cache breakpoint; other providers ignore the marker.
+SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "")
+
+_SYSTEM_MESSAGE: Optional[Dict[str, Any]] = {
+    "role": "system",
+    "content": [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}],
+} if SYSTEM_PROMPT else None
+
+# --- End Prompt prefix caching ---
+
+# --- Chat response cache ---
+# Conversations that should come back the same every time (temperature unset or 0) are
+# answered from memory when the same API key and model see them again. Keys are scoped per
+# API key, so a cached reply is never served to (or billed to) a different account. Only
+# leading and trailing whitespace is normalized: case and inner whitespace (code
+# indentation) can change what a prompt means. Entries are keyed by a 16-byte blake2b
+# digest, so the cache holds no key, conversation text or image data.
+CHAT_CACHE_TTL_SECONDS = 3600
+CHAT_CACHE_MAX_ENTRIES = 10_000
+
+_chat_cache: TTLCache = TTLCache(maxsize=CHAT_CACHE_MAX_ENTRIES, ttl=CHAT_CACHE_TTL_SECONDS)
+
+def _canonical_json(obj: Any) -> bytes:
+    """Serializes obj with sorted keys, so equal structures always hash to the same bytes."""
+    return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+def _normalize_text(text: str) -> str:
+    return text.strip()
+
+def _image_digest(image_data: str) -> bytes:
+    """Hashes an image data URL. Blocking for large images, so callers run it in a thread."""
+    return hashlib.blake2b(image_data.encode(), digest_size=16).digest()
+
+def _chat_cache_key(api_key: str, model_id: str, prompt: str, messages: List[ChatMessage], max_tokens: Optional[int], stop: Optional[List[str]], image_digest: bytes) -> Optional[str]:
+    """Returns the cache key for a conversation, or None if it contains non-text content.
+
+    The prompt is hashed alongside the history because an image attached after a non-user
+    message is sent in a new user message built from the prompt, not from the history.
+    """
+    normalized_messages = []
+    for message in messages:
+        if not isinstance(message.content, str):
+            return None
+        normalized_messages.append((message.role, _normalize_text(message.content)))
+    hasher = hashlib.blake2b(_canonical_json([_api_key_digest(api_key), model_id, _normalize_text(prompt), max_tokens, stop, normalized_messages]), digest_size=16)
+    if image_digest:
+        # JSON output never contains a raw NUL, so this separator cannot be forged by the text above
+        hasher.update(b"\x00")
+        hasher.update(image_digest)
+    return hasher.hexdigest()
+
+# Identical cacheable requests that overlap in time (double submits, several tabs) share
+# one upstream call instead of each paying a full round-trip. The cache key is already
+# scoped per API key, so one caller's key is never billed for, or fails, another's request.
+_chat_inflight: Dict[str, asyncio.Task] = {}
+
+async def _coalesced_completion(client: httpx.AsyncClient, cache_key: str, api_key: str, payload: Dict[str, Any]) -> str:
+    task = _chat_inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_fetch_openrouter_completion(client, api_key, payload))
+        _chat_inflight[cache_key] = task
+
+        def _release(finished: asyncio.Task):
+            _chat_inflight.pop(cache_key, None)
+            if not finished.cancelled():
+                finished.exception() # Mark retrieved even if every waiter has gone away
+
+        task.add_done_callback(_release)
+    # shield: one caller disconnecting must not cancel the call the others are waiting on
+    return await asyncio.shield(task)
+
+# --- End Chat response cache ---
+
+async def _fetch_openrouter_completion(client: httpx.AsyncClient, api_key: str, payload: Dict[str, Any]) -> str:
+    """Sends a chat completion to OpenRouter and returns the assistant message text."""
+    upstream_request = client.build_request("POST", "/chat/completions", headers=_openrouter_headers(api_key), content=orjson.dumps(payload))
+    response = await _send_openrouter(client, upstream_request)
+
+    response_data = orjson.loads(response.content)
+
+    # Check if 'choices' exists and is not empty
+    if 'choices' in response_data and response_data['choices']:
+        response_text = response_data['choices'][0]['message']['content']
+        return response_text
+
+    # Log the full response data for debugging
+    logger.error("Downstream AI API returned unexpected response: %s", response_data)
+
+    # Attempt to extract error message if available
+    error_message = "Downstream AI API call failed or returned an unexpected response."
+    if 'error' in response_data and 'message' in response_data['error']:
+        error_message = f"Downstream AI API error: {response_data['error']['message']}"
+
+    raise HTTPException(status_code=502, detail=error_message)
+
+# --- Streaming replies ---
+# Streamed replies are re-framed rather than relayed verbatim, so the client sees one small
+# protocol regardless of provider: {"role": "assistant", "content": <delta>} per token,
+# {"role": "sequential_thinking", "content": <output>} once thinking finishes,
+# {"role": "error", "content": <message>} on failure, then a final [DONE].
+# Frames are built as bytes straight from orjson; StreamingResponse sends bytes as-is, so
+# there is no decode here and no re-encode in Starlette.
+# Reverse proxies buffer responses by default, which would hold every token until the reply
+# ends; these headers tell nginx (and transforming caches) to pass frames through as sent.
+_SSE_HEADERS = {"X-Accel-Buffering": "no", "Cache-Control": "no-cache, no-transform"}
+
+def _sse_frame(role: str, content: Any) -> bytes:
+    return b"data: " + orjson.dumps({"role": role, "content": content}) + b"\n\n"
+
+# Token frames are the hot path: splice the encoded string into a fixed template instead of
+# building and serializing a dict per token. Same bytes as _sse_frame("assistant", content).
+_ASSISTANT_FRAME_PREFIX = b'data: {"role":"assistant","content":'
+_FRAME_SUFFIX = b"}\n\n"
+
+def _assistant_frame(content: str) -> bytes:
+    return _ASSISTANT_FRAME_PREFIX + orjson.dumps(content) + _FRAME_SUFFIX
+
+class _OpenRouterStream:
+    """An open upstream stream and the OPENROUTER_SEM slot it holds.
+
+    close() is idempotent, so the relay can give both back as soon as upstream finishes and
+    _SSEResponse can call it again unconditionally as the backstop.
+    """
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        self._closed = False
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self.response.aclose()
+        finally:
+            OPENROUTER_SEM.release()
+
+class _SSEResponse(StreamingResponse):
+    """An event-stream response that owns the resources behind its body iterator.
+
+    Starlette never starts the iterator if sending the response headers fails (the client
+    already left), so the iterator's own finally cannot be the only cleanup. The upstream
+    stream is closed (releasing its OPENROUTER_SEM slot) and the thinking task cancelled
+    here once the response is done, however it ended.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], upstream: Optional[_OpenRouterStream] = None, thinking_task: Optional[asyncio.Task] = None):
+        super().__init__(content, media_type="text/event-stream", headers=_SSE_HEADERS)
+        self._upstream = upstream
+        self._thinking_task = thinking_task
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self._thinking_task is not None and not self._thinking_task.done():
+                self._thinking_task.cancel()
+            if self._upstream is not None:
+                await self._upstream.close()
+
+async def _open_openrouter_stream(client: httpx.AsyncClient, api_key: str, payload: Dict[str, Any]) -> _OpenRouterStream:
+    """Starts a streamed completion and returns the stream once upstream headers arrive.
+
+    Failures (after retries) are raised before the 200 stream starts, so the client still
+    gets a real HTTP error. The stream holds an OPENROUTER_SEM slot until it is closed.
+    """
+    upstream_request = client.build_request("POST", "/chat/completions", headers=_openrouter_headers(api_key), content=orjson.dumps(payload))
+    return _OpenRouterStream(await _send_openrouter(client, upstream_request, stream=True))
+
+# Upstream SSE is parsed as raw bytes: orjson reads bytes directly, so decoding every line
+# to str (as aiter_lines does) only to re-encode it is skipped.
+_SSE_DATA_PREFIX = b"data: "
+_SSE_DATA_PREFIX_LEN = len(_SSE_DATA_PREFIX)
+_SSE_DONE = b"[DONE]"
+
+async def _iter_sse_lines(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Splits a streamed body into lines, carrying a partial line across network chunks.
+
+    Each chunk is scanned with a cursor, so a line that fits in one chunk is a single slice;
+    only a line that spans chunks is joined, once, when its terminator arrives.
+    """
+    carry: List[bytes] = []
+    async for chunk in response.aiter_bytes():
+        cursor = 0
+        while True:
+            end = chunk.find(b"\n", cursor)
+            if end < 0:
+                break
+            line = chunk[cursor:end]
+            if carry:
+                carry.append(line)
+                line = b"".join(carry)
+                carry.clear()
+            yield line[:-1] if line.endswith(b"\r") else line
+            cursor = end + 1
+        if cursor < len(chunk):
+            carry.append(chunk[cursor:])
+    if carry:
+        yield b"".join(carry)
+
+# Upstream deltas are often a single token, so sending each as its own frame costs more in
+# framing and chunked-encoding than in payload. Deltas are coalesced into one assistant frame
+# once STREAM_COALESCE_CHARS of text has built up or STREAM_COALESCE_SECONDS have passed
+# since the last frame. While text is held, the next line is awaited with that deadline, so
+# a pause upstream never delays text already received by more than the window.
+STREAM_COALESCE_CHARS = 64
+STREAM_COALESCE_SECONDS = 0.015
+
+async def _relay_openrouter_stream(upstream: _OpenRouterStream, thinking_task: Optional[asyncio.Task], cache_key: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Re-frames an upstream stream; with a cache_key, a reply that reaches [DONE] is also cached."""
+    parts: List[str] = []
+    pending: List[str] = []
+    pending_chars = 0
+    loop = asyncio.get_running_loop()
+    last_flush = loop.time()
+    lines = _iter_sse_lines(upstream.response)
+    # Only used while text is held: a read that outlives the deadline keeps running after the flush
+    next_line: Optional[asyncio.Future] = None
+    try:
+        while True:
+            if pending:
+                if next_line is None:
+                    next_line = asyncio.ensure_future(lines.__anext__())
+                done, _ = await asyncio.wait((next_line,), timeout=max(0.0, last_flush + STREAM_COALESCE_SECONDS - loop.time()))
+                if not done:
+                    yield _assistant_frame("".join(pending))
+                    pending.clear()
+                    pending_chars = 0
+                    last_flush = loop.time()
+            try:
+                if next_line is not None:
+                    line = await next_line
+                    next_line = None
+                else:
+                    line = await lines.__anext__()
+            except StopAsyncIteration:
+                break
+            # Blank separators and ": OPENROUTER PROCESSING" keep-alive comments carry no data
+            if not line.startswith(_SSE_DATA_PREFIX):
+                continue
+            # A view rather than a slice: orjson parses any buffer, so the payload is never copied
+            data = memoryview(line)[_SSE_DATA_PREFIX_LEN:]
+            if data == _SSE_DONE:
+                if cache_key is not None:
+                    _chat_cache[cache_key] = "".join(parts)
+                break
+            # Chunks are JSON objects; anything else is skipped on a one-byte check, so the
+            # exception path below only runs for a genuinely truncated or corrupt frame.
+            if data[:1] != b"{":
+                continue
+            try:
+                chunk = orjson.loads(data)
+            except orjson.JSONDecodeError:
+                logger.warning("Ignoring malformed SSE data from OpenRouter: %r", bytes(data[:200]))
+                continue
+            if "error" in chunk:
+                if pending:
+                    yield _assistant_frame("".join(pending))
+                    pending.clear()
+                # Providers send either {"message": ...} or a bare string here
+                error = chunk["error"]
+                message = error.get("message") if isinstance(error, dict) else error
+                yield _sse_frame("error", message if isinstance(message, str) and message else "Downstream AI API error")
+                break
+            choices = chunk.get("choices")
+            if choices:
+                choice = choices[0] if isinstance(choices, list) else None
+                # A final chunk may carry "delta": null alongside its finish_reason
+                delta = choice.get("delta") if isinstance(choice, dict) else None
+                content = delta.get("content") if isinstance(delta, dict) else None
+                if content and not isinstance(content, str):
+                    logger.warning("Ignoring non-text delta from OpenRouter: %r", content)
+                    continue
+                if content:
+                    if cache_key is not None:
+                        parts.append(content)
+                    pending.append(content)
+                    pending_chars += len(content)
+                    now = loop.time()
+                    if pending_chars >= STREAM_COALESCE_CHARS or now - last_flush > STREAM_COALESCE_SECONDS:
+                        yield _assistant_frame("".join(pending))
+                        pending.clear()
+                        pending_chars = 0
+                        last_flush = now
+
+        if pending:
+            yield _assistant_frame("".join(pending))
+            pending.clear()
+
+        # Upstream is finished; free its connection and slot before waiting on the MCP call
+        await upstream.close()
+        async for frame in _thinking_frames(thinking_task):
+            yield frame
+    except httpx.HTTPError as e:
+        logger.error("OpenRouter stream failed: %s", e)
+        if pending:
+            yield _assistant_frame("".join(pending))
+        yield _sse_frame("error", f"OpenRouter API error: {e}")
+    finally:
+        if next_line is not None and not next_line.done():
+            next_line.cancel()
+        await upstream.close()
+    yield b"data: [DONE]\n\n"
+
+# Cached replies are replayed in small pieces, yielding to the loop between them, so the
+# client still renders a typing stream rather than one block.
+CACHED_STREAM_CHUNK_CHARS = 20
+
+async def _replay_cached_stream(text: str, thinking_task: Optional[asyncio.Task]) -> AsyncIterator[bytes]:
+    # The thinking task is cancelled by _SSEResponse if the client goes away first
+    for start in range(0, len(text), CACHED_STREAM_CHUNK_CHARS):
+        yield _assistant_frame(text[start:start + CACHED_STREAM_CHUNK_CHARS])
+        await asyncio.sleep(0)
+
+    async for frame in _thinking_frames(thinking_task):
+        yield frame
+    yield b"data: [DONE]\n\n"
+
+async def _thinking_frames(thinking_task: Optional[asyncio.Task]) -> AsyncIterator[bytes]:
+    """Yields the sequential_thinking frame once the MCP call finishes, if it produced output."""
+    if thinking_task is not None:
+        thinking_output = await thinking_task
+        if thinking_output:
+            yield _sse_frame("sequential_thinking", thinking_output)
+
+# --- End Streaming replies ---
+
+async def _run_sequential_thinking(mcp_client: SequentialThinkingMCPClient, params: Dict[str, Any]) -> Any:
+    """Runs the MCP call for a chat request; a failure is logged and never fails the chat."""
+    logger.debug("Invoking Sequential Thinking MCP with params: %s", params)
+    try:
+        SequentialThinkingParams.model_validate(params)
+    except ValidationError as e:
+        logger.warning("Skipping Sequential Thinking MCP, invalid params: %s", e)
+        return None
+    try:
+        thinking_output = await mcp_client.invoke(params)
+        logger.debug("Sequential Thinking MCP output: %s", thinking_output)
+        return thinking_output
+    except HTTPException as e:
+        logger.error("Error invoking Sequential Thinking MCP: %s", e.detail)
+        # Log and continue with the LLM call rather than stopping the chat request
+        return None
 
 @app.post("/chat")
-async def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest, http_request: Request):
+    client = http_request.app.state.http_client
+    thinking_task = None
     try:
         user_prompt = request.prompt
         api_key = request.apiKey
         model_id = request.modelId
         image_data = request.imageData
 
-        logging.info(f"Received use_sequential_thinking: {request.use_sequential_thinking}")
+        if not api_key or not model_id:
+            raise HTTPException(status_code=400, detail="apiKey and modelId are required for openrouter mode")
 
         # --- MCP Sequential Thinking Integration ---
+        # Started first and awaited last, so it overlaps the OpenRouter call instead of
+        # adding to it; a streamed reply sends its result as the final frame.
         thinking_output = None
-        # The status check is removed as the subprocess is not managed here.
-        # We assume the external MCP server is running if use_sequential_thinking is True.
         if request.use_sequential_thinking and request.sequential_thinking_params:
-            logging.info(f"Invoking Sequential Thinking MCP with params: {request.sequential_thinking_params}")
-            print("Invoking Sequential Thinking MCP...")
-            try:
-                thinking_output = await invoke_sequential_thinking(request.sequential_thinking_params)
-                logging.info(f"Sequential Thinking MCP invocation successful. Output: {thinking_output}")
-                print("Sequential Thinking MCP invocation successful.")
-            except HTTPException as e:
-                print(f"Error invoking Sequential Thinking MCP: {e.detail}", file=sys.stderr)
-                # Decide how to handle this error: return it, log and continue, etc.
-                # For now, we'll just log and continue with the LLM call
-                pass # Or re-raise e if you want to stop the chat request
-
+            thinking_task = asyncio.create_task(
+                _run_sequential_thinking(http_request.app.state.mcp_client, request.sequential_thinking_params)
+            )
         # --- End MCP Sequential Thinking Integration ---
 
+        logger.debug("chat model=%s prompt_len=%d sequential_thinking=%s", model_id, len(user_prompt), request.use_sequential_thinking)
 
-        if not api_key or not model_id:
-            raise HTTPException(status_code=400, detail="apiKey and modelId are required for openrouter mode")
+        max_tokens = min(request.max_tokens, MAX_TOKENS_CAP) if request.max_tokens else None
+
+        cache_key = None
+        if request.temperature in (None, 0):
+            # A multi-megabyte data URL takes milliseconds to hash; keep that off the event loop
+            image_digest = await asyncio.to_thread(_image_digest, image_data) if image_data else b""
+            cache_key = _chat_cache_key(api_key, model_id, user_prompt, request.messages, max_tokens, request.stop, image_digest)
+        response_text = _chat_cache.get(cache_key) if cache_key is not None else None
+
+        if response_text is None:
+            # Serialize the history to plain dicts once; the image and system prefix below
+            # edit these dicts rather than the request models
+            messages_for_payload = [msg.model_dump() for msg in request.messages]
+
+            # If image data is present, add it to the last message in the history
+            if image_data and messages_for_payload:
+                 # Ensure the last message is from the user and has content
+                last_message = messages_for_payload[-1]
+                if last_message["role"] == "user":
+                    # Ensure content is a list
+                    if not isinstance(last_message["content"], list):
+                        last_message["content"] = [{"type": "text", "text": str(last_message["content"])}]
 
-        print(f"Generating completion for prompt: {user_prompt} with model {model_id}")
+                    # Add the image data as an image_url type
+                    last_message["content"].append({"type": "image_url", "image_url": {"url": image_data}})
+                else:
+                    # If the last message is not from the user, create a new user message
+                    logger.warning("Last message in history is not from user, adding new user message with image.")
+                    new_user_message_content = [{"type": "text", "text": user_prompt}]
+                    if image_data:
+                        new_user_message_content.append({"type": "image_url", "image_url": {"url": image_data}})
+                    messages_for_payload.append({"role": "user", "content": new_user_message_content})
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
+            # Keep a system message the frontend sent; otherwise lead with the shared cacheable prefix
+            if _SYSTEM_MESSAGE is not None and not (messages_for_payload and messages_for_payload[0]["role"] == "system"):
+                messages_for_payload = [_SYSTEM_MESSAGE, *messages_for_payload]
 
-        # Use the received messages list directly
-        messages_payload = request.messages
+            payload = {
+                "model": model_id,
+                "messages": messages_for_payload,
+            }
+            if max_tokens is not None:
+                payload["max_tokens"] = max_tokens
+            if request.stop:
+                payload["stop"] = request.stop
+            if request.temperature is not None:
+                payload["temperature"] = request.temperature
 
-        # If image data is present, add it to the last message in the history
-        if image_data and messages_payload:
-             # Ensure the last message is from the user and has content
-            last_message = messages_payload[-1]
-            if last_message.role == "user":
-                # Ensure content is a list
-                if not isinstance(last_message.content, list):
-                    last_message.content = [{"type": "text", "text": str(last_message.content)}]
+            if request.stream:
+                payload["stream"] = True
+                upstream = await _open_openrouter_stream(client, api_key, payload)
+                relay = _relay_openrouter_stream(upstream, thinking_task, cache_key)
+                response = _SSEResponse(relay, upstream, thinking_task)
+                thinking_task = None # Now owned by the response
+                return response
 
-                # Add the image data as an image_url type
-                last_message.content.append({"type": "image_url", "image_url": {"url": image_data}})
+            if cache_key is None:
+                response_text = await _fetch_openrouter_completion(client, api_key, payload)
             else:
-                # If the last message is not from the user, create a new user message
-                logging.warning("Last message in history is not from user, adding new user message with image.")
-                new_user_message_content = [{"type": "text", "text": user_prompt}]
-                if image_data:
-                    new_user_message_content.append({"type": "image_url", "image_url": {"url": image_data}})
-                messages_payload.append({"role": "user", "content": new_user_message_content})
-
-
-        payload = {
-            "model": model_id,
-            "messages": [msg.model_dump() if isinstance(msg, BaseModel) else msg for msg in messages_payload], # Convert ChatMessage models to dicts
-            # Include other parameters like max_tokens, temperature if needed
-        }
-
-        response = requests.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=payload)
-        response.raise_for_status() # Raise an exception for bad status codes
-
-        response_data = response.json()
-        
-        # Check if 'choices' exists and is not empty
-        if 'choices' in response_data and response_data['choices']:
-            response_text = response_data['choices'][0]['message']['content']
-            print(f"Generated response: {response_text}")
-            response_payload = {"response": response_text}
+                response_text = await _coalesced_completion(client, cache_key, api_key, payload)
+                _chat_cache[cache_key] = response_text
         else:
-            # Log the full response data for debugging
-            logging.error(f"Downstream AI API returned unexpected response: {response_data}")
-            
-            # Attempt to extract error message if available
-            error_message = "Downstream AI API call failed or returned an unexpected response."
-            if 'error' in response_data and 'message' in response_data['error']:
-                error_message = f"Downstream AI API error: {response_data['error']['message']}"
-                
-            raise HTTPException(status_code=502, detail=error_message)
+            logger.debug("Serving cached completion for model %s", model_id)
+            if request.stream:
+                replay = _replay_cached_stream(response_text, thinking_task)
+                response = _SSEResponse(replay, thinking_task=thinking_task)
+                thinking_task = None # Now owned by the response
+                return response
+
+        response_payload = {"response": response_text}
 
 
         # --- MCP Sequential Thinking Integration ---
+        if thinking_task is not None:
+            thinking_output = await thinking_task
         if thinking_output:
             response_payload["sequential_thinking_output"] = thinking_output
-            logging.info(f"Sending response to frontend with sequential_thinking_output: {response_payload.get('sequential_thinking_output')}")
         # --- End MCP Sequential Thinking Integration ---
 
         return response_payload
 
-    except requests.exceptions.RequestException as e:
-        print(f"Error during OpenRouter API call: {e}")
-        raise HTTPException(status_code=500, detail=f"OpenRouter API error: {e}")
-    except Exception as e:
-        print(f"Error during chat completion: {e}", file=sys.stderr)
-        raise HTTPException(status_code=500, detail=str(e))
+    except httpx.RequestError as e:
+        logger.error("Error during OpenRouter API call: %s", e)
+        raise HTTPException(status_code=502, detail=f"Failed to reach OpenRouter: {e}")
+    finally:
+        # The request failed before the thinking result was needed; don't leave the MCP call running
+        if thinking_task is not None and not thinking_task.done():
+            thinking_task.cancel()
 
 
 class ApiKeyRequest(BaseModel):
     api_key: str
 
+# --- Model catalog cache ---
+# The OpenRouter catalog changes rarely, so the serialized list is cached per API key
+# (keyed by a digest so raw keys are not held as dict keys) for a few minutes.
+MODELS_CACHE_TTL_SECONDS = 300
+
+_models_cache: TTLCache = TTLCache(maxsize=64, ttl=MODELS_CACHE_TTL_SECONDS)
+# Concurrent misses for the same key share one fetch; other keys, and every cache hit,
+# never wait on it.
+_models_inflight: Dict[str, asyncio.Task] = {}
+
+def _api_key_digest(api_key: str) -> str:
+    return hashlib.blake2b(api_key.encode(), digest_size=16).hexdigest()
+
+async def _fetch_models_body(client: httpx.AsyncClient, cache_key: str, api_key: str) -> bytes:
+    """Fetches the catalog for an API key, caches its serialized body and returns it."""
+    response = await _send_openrouter(client, client.build_request("GET", "/models", headers=_openrouter_headers(api_key)))
+
+    models_data = orjson.loads(response.content)
+    processed_models = _MODELS_ADAPTER.validate_python(models_data.get('data', []))
+    # Serialize once at fill time; hits return the bytes as-is, without FastAPI
+    # re-validating and re-encoding hundreds of ModelInfo objects per request.
+    models_body = _MODELS_ADAPTER.dump_json(processed_models)
+
+    _models_cache[cache_key] = models_body
+    return models_body
+
+# --- End Model catalog cache ---
+
 @app.get('/api/get_models', response_model=List[ModelInfo])
-async def get_models(authorization: str = Header(...)):
+async def get_models(request: Request, authorization: str = Header(...)):
+    # Extract API key from "Bearer <api_key>"; checked before the try so it stays a 401
+    api_key = authorization[7:].strip() if authorization.startswith("Bearer ") else ""
+    if not api_key:
+        raise HTTPException(status_code=401, detail="Missing or malformed bearer token", headers={"WWW-Authenticate": "Bearer"})
+
     try:
-        api_key = authorization.split(" ")[1] # Extract API key from "Bearer <api_key>"
-
-        headers = {"Authorization": f"Bearer {api_key}"}
-        response = requests.get('https://openrouter.ai/api/v1/models', headers=headers)
-
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail="Failed to fetch models from OpenRouter")
-
-        models_data = response.json()
-        processed_models = []
-        for model in models_data.get('data', []):
-            model_info = {
-                "id": model.get('id'),
-                "name": model.get('name'),
-                "pricing": {
-                    "prompt": float(model.get('pricing', {}).get('prompt', 0.0)),
-                    "completion": float(model.get('pricing', {}).get('completion', 0.0)),
-                    "image": float(model.get('pricing', {}).get('image', 0.0)),
-                    "request": float(model.get('pricing', {}).get('request', 0.0))
-                },
-                "context_length": model.get('context_length'),
-                "input_modalities": model.get('architecture', {}).get('input_modalities', [])
-            }
-            processed_models.append(model_info)
+        cache_key = _api_key_digest(api_key)
+
+        models_body = _models_cache.get(cache_key)
+        if models_body is None:
+            task = _models_inflight.get(cache_key)
+            if task is None:
+                task = asyncio.create_task(_fetch_models_body(request.app.state.http_client, cache_key, api_key))
+                _models_inflight[cache_key] = task
+
+                def _release(finished: asyncio.Task):
+                    _models_inflight.pop(cache_key, None)
+                    if not finished.cancelled():
+                        finished.exception() # Mark retrieved even if every waiter has gone away
+
+                task.add_done_callback(_release)
+            # shield: one caller disconnecting must not cancel the fetch the others are waiting on
+            models_body = await asyncio.shield(task)
+
+        return Response(content=models_body, media_type="application/json")
+
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Network error or failed to connect to OpenRouter: {e}")
+
+# --- Static asset cache ---
+class CachedStaticFiles(StaticFiles):
+    """StaticFiles that keeps small asset bodies and their ETag in memory.
+
+    Entries are keyed by (path, mtime, size), so a rebuilt bundle is picked up on the next
+    stat without any explicit invalidation. Files above STATIC_CACHE_MAX_FILE_BYTES, Range
+    requests and cache misses are streamed from disk as usual.
+
+    Content-hashed build outputs (outputHashing "all" emits e.g. main-ABCDEF12.js) never
+    change under the same name, so browsers are told to keep them for a year without
+    revalidating. index.html is unhashed and keeps the ETag round-trip.
+    """
+
+    STATIC_CACHE_MAX_ENTRIES = 256
+    STATIC_CACHE_MAX_FILE_BYTES = 8 * 1024 * 1024
+    IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+    HASHED_FILENAME = re.compile(r"-[A-Z0-9]{8}\.[A-Za-z0-9]+$")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file_cache: LRUCache = LRUCache(maxsize=self.STATIC_CACHE_MAX_ENTRIES)
+        self._file_cache_fills: Dict[Tuple[str, int, int], asyncio.Task] = {}
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        # Range requests need FileResponse's 206 handling
+        if stat_result.st_size > self.STATIC_CACHE_MAX_FILE_BYTES or "range" in request_headers:
+            return self._disk_response(full_path, stat_result, scope, status_code)
+
+        cache_key = (str(full_path), stat_result.st_mtime_ns, stat_result.st_size)
+        cached = self._file_cache.get(cache_key)
+        if cached is None:
+            # Reading up to STATIC_CACHE_MAX_FILE_BYTES would block the event loop, so a miss is
+            # served from disk (FileResponse reads in a worker thread) while the entry is loaded
+            # in a thread for the requests that follow. The entry reuses FileResponse's stat-based
+            # validators, so a client's ETag stays valid whichever path answers next.
+            response = self._disk_response(full_path, stat_result, scope, status_code)
+            if cache_key not in self._file_cache_fills:
+                headers = {name: response.headers[name] for name in ("etag", "last-modified", "cache-control", "accept-ranges") if name in response.headers}
+                self._file_cache_fills[cache_key] = asyncio.get_running_loop().create_task(
+                    self._fill_file_cache(cache_key, full_path, headers)
+                )
+            return response
+
+        content, headers, media_type = cached
+        if self.is_not_modified(Headers(headers), request_headers):
+            return NotModifiedResponse(Headers(headers))
+        return Response(content, status_code=status_code, headers=headers, media_type=media_type)
+
+    def _disk_response(self, full_path, stat_result, scope, status_code: int) -> Response:
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        if self.HASHED_FILENAME.search(str(full_path)):
+            response.headers["cache-control"] = self.IMMUTABLE_CACHE_CONTROL
+        return response
+
+    async def _fill_file_cache(self, cache_key: Tuple[str, int, int], full_path, headers: Dict[str, str]):
+        try:
+            content = await asyncio.to_thread(self._read_file, full_path)
+            media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+            self._file_cache[cache_key] = (content, headers, media_type)
+        except OSError as e:
+            logger.warning("Could not cache static file %s: %s", full_path, e)
+        finally:
+            del self._file_cache_fills[cache_key]
 
-        return processed_models
+    @staticmethod
+    def _read_file(full_path) -> bytes:
+        with open(full_path, "rb") as f:
+            return f.read()
 
-    except requests.exceptions.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Network error or failed to connect to OpenRouter: {e}")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {e}")
+app.mount("/static", CachedStaticFiles(directory="dist/angular-app", html = True), name="static")
 
-app.mount("/static", StaticFiles(directory="dist/angular-app", html = True), name="static")
+# --- End Static asset cache ---
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # uvloop + httptools replace the stdlib loop and pure-Python HTTP parser. Extra workers
+    # need the import string; each worker creates its own HTTP pool and MCP server child
+    # on startup. See README.md for running under gunicorn in production.
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WORKERS", str(os.cpu_count() or 1))),
+    )
\ No newline at end of file